@@ -1,7 +1,10 @@
 # Python standard libraries
-import json
 import os
+import re
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # Third party libraries
 from flask import Flask, redirect, request, url_for, render_template
@@ -12,50 +15,163 @@ from flask_login import (
     login_user,
     logout_user,
 )
+from dotenv import load_dotenv
 from oauthlib.oauth2 import WebApplicationClient
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Internal imports
-from db import init_db_command
+from db import init_app, init_db
 from user import User
-from ultimaker import Ultimaker, PrintJob, PrintJobState, PrintJobResult
+from ultimaker import (
+    Ultimaker,
+    UltimakerNotFound,
+    PrintJob,
+    PrintJobState,
+    PrintJobResult,
+)
 
 # Configuration
+# Pick up settings from a local .env file during development
+load_dotenv()
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
 GOOGLE_DISCOVERY_URL = (
     "https://accounts.google.com/.well-known/openid-configuration"
 )
+# Google serves the discovery document with max-age=3600
+GOOGLE_DISCOVERY_MAX_AGE = 3600
+
+# (connect, read) timeouts in seconds for calls to Google
+GOOGLE_TIMEOUT = (3.05, 5)
+# Printers are on the local network, so give up on them quickly
+PRINTER_TIMEOUT = 2
+
+# Shared HTTP session so logins and printer polls reuse keep-alive connections
+HTTP = requests.Session()
+# Google gets one retry for transient failures
+HTTP.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=1, backoff_factor=0.1),
+))
+# A printer that doesn't answer is just turned off, so don't retry it
+HTTP.mount("http://", HTTPAdapter(max_retries=0))
+
+# Printers are created once and share the pooled session above
+XEROX_PRINTER = Ultimaker(
+    "172.31.228.191", None, None, session=HTTP, timeout=PRINTER_TIMEOUT
+)
+GUTENBERG_PRINTER = Ultimaker(
+    "172.31.228.190", None, None, session=HTTP, timeout=PRINTER_TIMEOUT
+)
+
+# Worker threads for outbound calls that shouldn't block a request
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# File types accepted for print requests
+ALLOWED_FILE_NAME = re.compile(r"\.(stl|zip)\Z", re.IGNORECASE)
+
+# Messages shown on the status page for each print job state
+STATUS_MESSAGES = {
+    PrintJobState.NO_JOB: "The Printer is not currently working on a print",
+    PrintJobState.PRINTING: "The Printer is currently working on a print",
+    PrintJobState.PAUSING: "The Printer is pausing the print",
+    PrintJobState.PAUSED: "The Printer is currently paused",
+    PrintJobState.RESUMING: "The Printer is resuming",
+    PrintJobState.PRE_PRINT: "The Printer is currently getting ready to start a print",
+    PrintJobState.POST_PRINT: "The Printer is finished with a print",
+    PrintJobState.WAIT_CLEANUP: "The Printer is waiting for a member to clean up a finished print",
+    PrintJobState.WAIT_USER_ACTION: "The Printer is waiting for a member to reset it",
+}
+# Anything else, including UNKNOWN, means the printer is off
+DEFAULT_STATUS_MESSAGE = "The Printer is currently turned off"
 
 # Flask app setup
 app = Flask(__name__)
-app.secret_key = os.environ.get("SECRET_KEY") or os.urandom(24)
+# Must be the same across restarts and gunicorn workers or sessions won't carry over
+app.secret_key = os.getenv('SECRET_KEY')
+if not app.secret_key:
+    raise RuntimeError(
+        "SECRET_KEY is not set. Set it in the environment or in a .env file."
+    )
 
 # User session management setup
 # https://flask-login.readthedocs.io/en/latest
 login_manager = LoginManager()
 login_manager.init_app(app)
 
+# Database connection teardown and the init-db CLI command
+init_app(app)
+
 
 @login_manager.unauthorized_handler
 def unauthorized():
     return "You must be logged in to access this content.", 403
 
 
-# Naive database setup
-try:
-    init_db_command()
-except sqlite3.OperationalError:
-    # Assume it's already been created
-    pass
+# Naive database setup, the schema only creates tables that are missing
+with app.app_context():
+    init_db()
+
+# These pages have no per-request context, so render them once at startup
+with app.app_context():
+    WELCOME_HTML = render_template('welcome.html')
+    QUEUE_HTML = render_template('queue.html')
+    MEMBERS_HTML = render_template('members.html')
+    FAILURE_HTML = render_template('failure.html')
 
 # OAuth2 client setup
 client = WebApplicationClient(GOOGLE_CLIENT_ID)
 
+
+# Fetch the discovery document in the background when the app starts serving
+# (see wsgi.py), so logins don't wait on it and a connection to Google is open
+def prefetch_google_provider_cfg():
+    EXECUTOR.submit(get_google_provider_cfg).add_done_callback(log_prefetch_error)
+
+
+def log_prefetch_error(future):
+    if future.exception() is not None:
+        app.logger.error(
+            "Prefetching the Google discovery document failed: %s",
+            future.exception(),
+        )
+
+
 # Flask-Login helper to retrieve a user from our db
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get(user_id)
+    try:
+        return get_cached_user(user_id)
+    except KeyError:
+        return None
+
+
+# Profiles don't change once created, so skip the database on repeat hits
+@lru_cache(maxsize=1024)
+def get_cached_user(user_id):
+    user = User.get(user_id)
+    if user is None:
+        # Raising keeps misses out of the cache
+        raise KeyError(user_id)
+    return user
+
+
+# Let the browser reuse these pages briefly and revalidate them by ETag
+CACHEABLE_ENDPOINTS = {"index", "queue", "members"}
+
+
+@app.after_request
+def add_cache_headers(response):
+    if request.endpoint in CACHEABLE_ENDPOINTS and response.status_code == 200:
+        response.headers["Cache-Control"] = "private, max-age=60"
+        # Logging in or out changes the session cookie, so the cached copy is dropped
+        response.vary.add("Cookie")
+        response.add_etag()
+        response.make_conditional(request)
+    return response
 
 
 @app.route("/")
@@ -63,7 +179,7 @@ def index():
     if current_user.is_authenticated:
         return render_template('form.html', name = current_user.name)
     else:
-        return render_template('welcome.html')
+        return WELCOME_HTML
 
 
 @app.route("/login")
@@ -99,31 +215,35 @@ def callback():
         redirect_url=request.base_url,
         code=code,
     )
-    token_response = requests.post(
+    token_response = HTTP.post(
         token_url,
         headers=headers,
         data=body,
         auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
+        timeout=GOOGLE_TIMEOUT,
     )
 
     # Parse the tokens!
-    client.parse_request_body_response(json.dumps(token_response.json()))
+    client.parse_request_body_response(token_response.text)
 
     # Now that we have tokens (yay) let's find and hit URL
     # from Google that gives you user's profile information,
     # including their Google Profile Image and Email
     userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
     uri, headers, body = client.add_token(userinfo_endpoint)
-    userinfo_response = requests.get(uri, headers=headers, data=body)
+    userinfo_response = HTTP.get(
+        uri, headers=headers, data=body, timeout=GOOGLE_TIMEOUT
+    )
 
     # We want to make sure their email is verified.
     # The user authenticated with Google, authorized our
     # app, and now we've verified their email through Google!
-    if userinfo_response.json().get("email_verified"):
-        unique_id = userinfo_response.json()["sub"]
-        users_email = userinfo_response.json()["email"]
-        picture = userinfo_response.json()["picture"]
-        users_name = userinfo_response.json()["name"]
+    userinfo = userinfo_response.json()
+    if userinfo.get("email_verified"):
+        unique_id = userinfo["sub"]
+        users_email = userinfo["email"]
+        picture = userinfo["picture"]
+        users_name = userinfo["name"]
     else:
         return "User email not available or not verified by Google.", 400
 
@@ -133,9 +253,12 @@ def callback():
         id_=unique_id, name=users_name, email=users_email, profile_pic=picture
     )
 
-    # Doesn't exist? Add to database
-    if not User.get(unique_id):
+    # Doesn't exist? Add to database (existing users are left as they are)
+    try:
         User.create(unique_id, users_name, users_email, picture)
+    except sqlite3.IntegrityError:
+        # The email is already stored under a different Google account
+        return "This email is already registered to another account.", 409
 
     # Begin user session by logging the user in
     login_user(user)
@@ -161,45 +284,31 @@ def req_form():
 @login_required
 def printer_status():
     print("STATUS")
-    # Xerox request state
-    try:
-        Xerox = PrintJob(Ultimaker("172.31.228.191", None, None))
-        Xerox_status = Xerox.state
-    except Exception as e:
-        # If Printer is not doing a job
-        if str(e) == 'Not found':
-            Xerox_status = PrintJobState.NO_JOB 
-        # Printer is off, UNKNOWN = OFF
-        else:
-            Xerox_status = PrintJobState.UNKNOWN
-    
-    # Gutenberg request state
-    try:
-        Gutenberg = PrintJob(Ultimaker("172.31.228.190", None, None))
-        Gutenberg_status = Gutenberg.state
-    except Exception as e:
-        # If Printer is not doing a job
-        if str(e) == 'Not found':
-            Gutenberg_status = PrintJobState.NO_JOB 
-        # Printer is off, UNKNOWN = OFF
-        else:
-            Gutenberg_status = PrintJobState.UNKNOWN
+    # Both printers are polled at the same time
+    Xerox_future = EXECUTOR.submit(get_printer_state, XEROX_PRINTER)
+    Gutenberg_future = EXECUTOR.submit(get_printer_state, GUTENBERG_PRINTER)
+    Xerox_status = Xerox_future.result()
+    Gutenberg_status = Gutenberg_future.result()
 
     Xerox_Gutenberg_status_str = get_status_string(Xerox_status, Gutenberg_status)
 
-    return render_template('status.html')
+    return render_template(
+        'status.html',
+        xerox=Xerox_Gutenberg_status_str[0],
+        gutenberg=Xerox_Gutenberg_status_str[1],
+    )
 
 
 @app.route("/queue")
 @login_required
 def queue():
-    return render_template('queue.html')
+    return QUEUE_HTML
 
 
 @app.route("/members")
 @login_required
 def members():
-    return render_template('members.html')
+    return MEMBERS_HTML
 
 
 @app.route("/success", methods=["POST"])
@@ -219,37 +328,49 @@ def success():
 @app.route("/error-no-print-attached")
 @login_required
 def failure():
-    return render_template('failure.html')
+    return FAILURE_HTML
+
+
+# Cached discovery document as (fetched_at, document)
+_google_provider_cfg = (0, None)
 
 
 def get_google_provider_cfg():
-    return requests.get(GOOGLE_DISCOVERY_URL).json()
+    global _google_provider_cfg
+    fetched_at, cfg = _google_provider_cfg
+    if cfg is None or time.monotonic() - fetched_at > GOOGLE_DISCOVERY_MAX_AGE:
+        response = HTTP.get(GOOGLE_DISCOVERY_URL, timeout=GOOGLE_TIMEOUT)
+        # Only a good document gets cached, errors are retried on the next login
+        response.raise_for_status()
+        cfg = response.json()
+        _google_provider_cfg = (time.monotonic(), cfg)
+    return cfg
 
 
 def request_has_printjob(results):
-    # Check if has link
-    if results.get("link") == '':
-        # Check if has file
-        if results.get("files") == '':
-            # No print was given
-            return False
-        # Check the file type
-        if check_file_type_not_allowed(results.get("files")):
-            # File is neither an stl or zip file
-            return False
+    # A link is enough on its own
+    if results.get("link"):
+        return True
 
-    return True
+    # Otherwise there has to be a file of an allowed type
+    file_name = results.get("files")
+    return bool(file_name) and not check_file_type_not_allowed(file_name)
 
 
 def check_file_type_not_allowed(file_name):
-    # If the file is not a stl file
-    if ".stl" not in file_name:
-        # If the file is not a zip file
-        if ".zip" not in file_name:
-            return True
-    
-    # The file is either an stl or a zip
-    return False
+    # The file must be either an stl or a zip
+    return ALLOWED_FILE_NAME.search(file_name) is None
+
+
+def get_printer_state(printer):
+    try:
+        return PrintJob(printer).state
+    except UltimakerNotFound:
+        # If Printer is not doing a job
+        return PrintJobState.NO_JOB
+    except Exception:
+        # Printer is off, UNKNOWN = OFF
+        return PrintJobState.UNKNOWN
 
 
 def get_status_string(Xerox, Gutenberg):
@@ -259,27 +380,4 @@ def get_status_string(Xerox, Gutenberg):
 
 
 def get_status_message(status):
-    if status == PrintJobState.NO_JOB:
-        return "The Printer is not currently working on a print"
-    elif status == PrintJobState.PRINTING:
-        return "The Printer is currently working on a print"
-    elif status == PrintJobState.PAUSING:
-        return "The Printer is pausing the print"
-    elif status == PrintJobState.PAUSED:
-        return "The Printer is currently paused"
-    elif status == PrintJobState.RESUMING:
-        return "The Printer is resuming"
-    elif status == PrintJobState.PRE_PRINT:
-        return "The Printer is currently getting ready to start a print"
-    elif status == PrintJobState.POST_PRINT:
-        return "The Printer is finished with a print"
-    elif status == PrintJobState.WAIT_CLEANUP:
-        return "The Printer is waiting for a member to clean up a finished print"
-    elif status == PrintJobState.WAIT_USER_ACTION:
-        return "The Printer is waiting for a member to reset it"
-    else:
-        return "The Printer is currently turned off"
-
-if __name__ == "__main__":
-    # Run HTTPS
-    app.run(ssl_context="adhoc")
+    return STATUS_MESSAGES.get(status, DEFAULT_STATUS_MESSAGE)
@@ -1,17 +1,26 @@
 # http://flask.pocoo.org/docs/1.0/tutorial/database/
 import sqlite3
+import threading
 
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 
 
+# Each worker thread keeps one connection open and reuses it across requests
+_local = threading.local()
+
+
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(
-            "sqlite_db", detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        db = getattr(_local, "db", None)
+        if db is None:
+            db = sqlite3.connect(
+                "sqlite_db", detect_types=sqlite3.PARSE_DECLTYPES
+            )
+            db.row_factory = sqlite3.Row
+            _local.db = db
+        g.db = db
 
     return g.db
 
@@ -20,7 +29,8 @@ def close_db(e=None):
     db = g.pop("db", None)
 
     if db is not None:
-        db.close()
+        # Drop anything left uncommitted; the connection stays open for reuse
+        db.rollback()
 
 
 def init_db():
@@ -33,7 +43,7 @@ def init_db():
 @click.command("init-db")
 @with_appcontext
 def init_db_command():
-    """Clear the existing data and create new tables."""
+    """Create the tables if they don't already exist."""
     init_db()
     click.echo("Initialized the database.")
 
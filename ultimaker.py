@@ -34,9 +34,17 @@ from requests.auth import HTTPDigestAuth
 def _dt(string): return None if not string else datetime.datetime.fromisoformat(string.rstrip("Z"))
 def _extract(dictionary, *keys): return {k:dictionary[k] for k in keys}
 
+# Raised when the printer answers 404, e.g. asking for the print job when nothing is printing.
+# Subclasses KeyError so existing lookups that catch KeyError keep working.
+class UltimakerNotFound(KeyError): pass
+
 class Ultimaker:
-    def __init__(self, hostname, username=None, password=None):
+    def __init__(self, hostname, username=None, password=None, session=None, timeout=None):
         self._hostname = hostname
+        # An optional requests.Session lets callers reuse connections to the printer
+        if session is not None: self._session = session
+        # Seconds to wait on the printer before giving up, None waits forever
+        if timeout is not None: self._timeout = timeout
         if username is not None and password is not None:
             self._auth = HTTPDigestAuth(username, password)
 
@@ -55,7 +63,7 @@ class Ultimaker:
             except ValueError: data = {}
             if 'message' in data:
                 if response.status_code == 404:
-                    raise KeyError(data['message'])
+                    raise UltimakerNotFound(data['message'])
                 raise ValueError(data['message'])
             else: response.raise_for_status()
         res = response.json()
@@ -65,6 +73,8 @@ class Ultimaker:
         return res
 
     _auth = None
+    _session = requests
+    _timeout = None
     def _get_auth(self):
         if self._auth is None:
             # Try to load a saved copy of the authetication credentials
@@ -76,19 +86,24 @@ class Ultimaker:
         return self._auth
 
     def _get(self, cmd):
-        return Ultimaker._check_response(requests.get(self._url(cmd), auth=self._auth))
+        return Ultimaker._check_response(self._session.get(self._url(cmd), auth=self._auth,
+                                                           timeout=self._timeout))
     def _put(self, cmd, data):
-        return Ultimaker._check_response(requests.put(self._url(cmd),
-                                                      json=data, auth=self._get_auth()))
+        return Ultimaker._check_response(self._session.put(self._url(cmd),
+                                                           json=data, auth=self._get_auth(),
+                                                           timeout=self._timeout))
     def _post(self, cmd, data):
-        return Ultimaker._check_response(requests.post(self._url(cmd),
-                                                       json=data, auth=self._get_auth()))
+        return Ultimaker._check_response(self._session.post(self._url(cmd),
+                                                            json=data, auth=self._get_auth(),
+                                                            timeout=self._timeout))
     def _delete(self, cmd, data=None):
-        return Ultimaker._check_response(requests.delete(self._url(cmd),
-                                                         json=data, auth=self._get_auth()))
+        return Ultimaker._check_response(self._session.delete(self._url(cmd),
+                                                              json=data, auth=self._get_auth(),
+                                                              timeout=self._timeout))
 
     def _get_file(self, cmd):
-        response = requests.get(self._url(cmd), auth=self._get_auth())
+        response = self._session.get(self._url(cmd), auth=self._get_auth(),
+                                     timeout=self._timeout)
         response.raise_for_status()
         return response.text
     def _post_file(self, cmd, file, data=None):
@@ -104,12 +119,14 @@ class Ultimaker:
         elif isinstance(file, str):
             files = {'file':(os.path.basename(file), open(file, 'rb'))}
         return Ultimaker._check_response(
-            requests.post(self._url(cmd), data=data, files=files, auth=self._get_auth()))
+            self._session.post(self._url(cmd), data=data, files=files, auth=self._get_auth(),
+                               timeout=self._timeout))
     def _put_file(self, cmd, file, data=None):
         if isinstance(file, dict): files = file
         elif isinstance(file, str): files = {'file':(os.path.basename(file), open(file, 'rb'))}
-        return Ultimaker._check_response(requests.put(self._url(cmd), data=data, files=files,
-                                                      auth=self._get_auth()))
+        return Ultimaker._check_response(self._session.put(self._url(cmd), data=data, files=files,
+                                                           auth=self._get_auth(),
+                                                           timeout=self._timeout))
 
     @property
     def id(self): return self._auth.username #pylint: disable=invalid-name
@@ -147,7 +164,8 @@ class Auth:
             host_name = platform.node()
         data = {'application':application, 'user':user, 'host_name':host_name}
         if exclusion_key is not None: data['exclusion_key'] = exclusion_key
-        response = requests.post(self._ultimaker._url('auth/request'), data=data)
+        response = self._ultimaker._session.post(self._ultimaker._url('auth/request'), data=data,
+                                                 timeout=self._ultimaker._timeout)
         if response.status_code != 200: response.raise_for_status()
         data = Ultimaker._check_response(response)
         return data["id"], data["key"]
@@ -158,8 +176,9 @@ class Auth:
     def check(self, id_): return self._ultimaker._get('auth/check/'+id_)["message"]
 
     def verify(self, auth=None):
-        response = requests.get(self._ultimaker._url('auth/verify'),
-                                auth=auth or self._ultimaker._auth)
+        response = self._ultimaker._session.get(self._ultimaker._url('auth/verify'),
+                                                auth=auth or self._ultimaker._auth,
+                                                timeout=self._ultimaker._timeout)
         return response.status_code == 200 and response.json()["message"] == "ok"
         # otherwise:
         #   response.status_code == 403 and response.json()["message"] == "Authorization required."
@@ -1579,8 +1598,9 @@ class Camera:
 
     # These take indices and give redirects to the proper URLs
     def __get_redir(self, name, i):
-        response = requests.get(self._ultimaker._url('camera/%d/%s'%(i, name)),
-                                allow_redirects=False)
+        response = self._ultimaker._session.get(self._ultimaker._url('camera/%d/%s'%(i, name)),
+                                                allow_redirects=False,
+                                                timeout=self._ultimaker._timeout)
         if response.status_code == 302:
             return response.headers['Location']
         if response.json()['message'] == "Camera index not found": raise IndexError()
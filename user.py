@@ -29,7 +29,8 @@ class User(UserMixin):
         db = get_db()
         db.execute(
             "INSERT INTO user (id, name, email, profile_pic)"
-            " VALUES (?, ?, ?, ?)",
+            " VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(id) DO NOTHING",
             (id_, name, email, profile_pic),
         )
         db.commit()
@@ -0,0 +1,29 @@
+# WSGI entry point for running the app under gunicorn behind NGINX:
+#
+#   gunicorn -k gthread -w $(nproc) --threads 8 -b 127.0.0.1:8000 wsgi:application
+#
+# NGINX terminates TLS and proxies to gunicorn, e.g.
+#
+#   upstream printmanagement { server 127.0.0.1:8000; keepalive 32; }
+#   ssl_session_cache shared:SSL:10m;
+#   location / {
+#       proxy_pass http://printmanagement;
+#       proxy_http_version 1.1;
+#       proxy_set_header Connection "";
+#       proxy_set_header Host $host;
+#       proxy_set_header X-Forwarded-Proto $scheme;
+#   }
+
+# Third party libraries
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# Internal imports
+from app import app, prefetch_google_provider_cfg
+
+# Trust NGINX's forwarded headers so the OAuth redirect URLs stay https
+app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+# Only the server warms the Google cache, not CLI commands that import app
+prefetch_google_provider_cfg()
+
+application = app